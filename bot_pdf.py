@@ -3,11 +3,26 @@ import re
 import io
 import logging
 import tempfile
+import shutil
 import uuid
+import secrets
+import time
+import asyncio
+import signal
+import subprocess
+import heapq
+import itertools
+import threading
 import concurrent.futures
+import multiprocessing
+from concurrent.futures.process import BrokenProcessPool
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
+    BaseRateLimiter,
+    BaseUpdateProcessor,
     CommandHandler,
     ContextTypes,
     MessageHandler,
@@ -19,7 +34,6 @@ from PyPDF2 import PdfReader, PdfWriter, PdfMerger
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.utils import ImageReader
-from pdf2image import convert_from_path
 import pytesseract
 import pikepdf
 from PIL import Image
@@ -29,6 +43,11 @@ from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
 
+try:
+    import resource
+except ImportError:  # Not available on Windows; worker limits are skipped
+    resource = None
+
 # Enable logging
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
@@ -51,12 +70,103 @@ CLIENT_CONFIG = {
 }
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 
+# OCR rasterization settings
+OCR_MIN_DPI = 150
+OCR_MAX_DPI = 400
+OCR_DEFAULT_DPI = 300
+OCR_TARGET_GLYPH_PX = 30  # Rendered glyph height Tesseract reads best at
+
+# Admission control and per-worker resource limits
+WORKER_PROCESSES = os.cpu_count() or 2
+JOB_MAX_FILE_MB = 50
+JOB_MAX_PAGES = 300
+JOB_MAX_MEGAPIXELS = 1500  # Rendered pixels for one job before it is downgraded
+JOB_DOWNGRADE_DPI = OCR_MIN_DPI
+GLOBAL_MAX_MEGAPIXELS = 4000  # Rendered pixels across all jobs in flight
+JOB_MAX_TASKS_IN_FLIGHT = max(WORKER_PROCESSES // 2, 1)  # OCR threads one job may hold
+WORKER_CPU_SECONDS = 120  # Per page, for each pdftoppm/Tesseract run
+WORKER_TIMEOUT_SECONDS = 300  # Wall clock, per page
+WORKER_MEMORY_MB = 1536
+
+# PDF encryption is AES-256 (revision 6). Restricted encryption allows printing but
+# not copying or editing; viewers only enforce that for readers who lack the owner
+# password, so that one is random and never stored.
+PDF_PERMISSIONS = pikepdf.Permissions(
+    accessibility=True,
+    extract=False,
+    modify_annotation=False,
+    modify_assembly=False,
+    modify_form=False,
+    modify_other=False,
+    print_lowres=True,
+    print_highres=True,
+)
+
+# Outbound Bot API scheduling
+GLOBAL_SENDS_PER_SECOND = 30
+CHAT_SEND_INTERVAL = 1.0  # Seconds between requests to the same chat
+OUTBOUND_POOL_SIZE = 64  # Pooled HTTP connections for outbound requests
+PRIORITY_RESULT, PRIORITY_PROGRESS = range(2)
+EDIT_ENDPOINTS = {"editMessageText", "editMessageCaption", "editMessageReplyMarkup"}
+MAX_MESSAGE_LENGTH = 4096  # Telegram rejects longer message texts
+
+# Incoming updates: concurrent across users, one at a time per user
+MAX_CONCURRENT_UPDATES = 256
+
+active_job_megapixels = 0.0
+progress_tasks = set()  # Progress updates still being sent
+job_lock = threading.Lock()
+# OCR threads each drive one pdftoppm/Tesseract process at a time
+ocr_executor = concurrent.futures.ThreadPoolExecutor(max_workers=WORKER_PROCESSES)
+# Batch workers start from a clean process instead of a fork of this threaded one
+if "forkserver" in multiprocessing.get_all_start_methods():
+    worker_mp_context = multiprocessing.get_context("forkserver")
+    if __name__ != "__main__":
+        worker_mp_context.set_forkserver_preload([__name__])
+else:
+    worker_mp_context = multiprocessing.get_context("spawn")
+
 # Initialize OCR engine
 try:
     pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'
 except:
     logger.warning("Tesseract not found. OCR functionality may not work")
 
+async def send_progress(update, context, text):
+    """Queue a progress message without waiting for it to be sent.
+
+    The outbound scheduler sends results ahead of it and drops it if a
+    later edit of the same message supersedes it.
+    """
+    return await queue_progress(context.bot.send_message(
+        update.effective_chat.id, text, rate_limit_args={"priority": PRIORITY_PROGRESS}
+    ))
+
+async def edit_progress(query, context, text):
+    """Queue a progress update of a callback query's message without waiting for it."""
+    return await queue_progress(context.bot.edit_message_text(
+        text,
+        chat_id=query.message.chat_id,
+        message_id=query.message.message_id,
+        rate_limit_args={"priority": PRIORITY_PROGRESS}
+    ))
+
+async def queue_progress(request):
+    """Send a Bot API request in the background and return its task."""
+    task = asyncio.create_task(request)
+    progress_tasks.add(task)
+    task.add_done_callback(progress_done)
+    # Let the request reach the outbound scheduler, so the handler's later
+    # requests are queued after it and can supersede it
+    await asyncio.sleep(0)
+    return task
+
+def progress_done(task):
+    """Forget a finished progress task and log it if it failed."""
+    progress_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.warning("Could not send a progress update: %s", task.exception())
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start the conversation and ask for PDF."""
     await update.message.reply_text(
@@ -94,7 +204,8 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return await show_action_menu(update, context, user_id)
     
     # For multiple files, stay in upload state
-    await update.message.reply_text(
+    await send_progress(
+        update, context,
         f"📚 File added to batch! Total files: {len(user_data[user_id]['files'])}\n"
         "Send more files or /process to start batch processing."
     )
@@ -129,7 +240,8 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         return await show_action_menu(update, context, user_id)
     
     # For multiple files, stay in upload state
-    await update.message.reply_text(
+    await send_progress(
+        update, context,
         f"📸 Photo added to batch! Total files: {len(user_data[user_id]['files'])}\n"
         "Send more files or /process to start batch processing."
     )
@@ -198,7 +310,11 @@ async def handle_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         return DELETE_PAGES
         
     elif action == "insert":
-        await query.edit_message_text("Send the PDF page to insert (as a separate file):")
+        await query.edit_message_text(
+            "Send the PDF page to insert (as a separate file).\n"
+            "Put a page number in the caption to insert after that page (0 for the start); "
+            "without one it goes at the end."
+        )
         return INSERT_PAGE
         
     elif action == "compress":
@@ -209,11 +325,14 @@ async def handle_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         return REARRANGE
         
     elif action == "ocr":
-        await query.edit_message_text("Performing OCR... This may take a while...")
+        await edit_progress(query, context, "Performing OCR... This may take a while...")
         return await ocr_pdf(update, context)
         
     elif action == "encrypt":
-        await query.edit_message_text("Enter password and operation (e.g., 'encrypt mypassword' or 'decrypt mypassword'):")
+        await query.edit_message_text(
+            "Enter password and operation (e.g., 'encrypt mypassword' or 'decrypt mypassword').\n"
+            "Use 'encrypt-restricted mypassword' to also block copying and editing."
+        )
         return ENCRYPT
         
     elif action == "watermark":
@@ -228,7 +347,7 @@ async def handle_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         return WATERMARK
         
     elif action == "cloud":
-        await query.edit_message_text("Preparing for cloud save...")
+        await edit_progress(query, context, "Preparing for cloud save...")
         return await cloud_save(update, context)
         
     elif action == "batch":
@@ -243,7 +362,155 @@ async def handle_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     
     return ACTION
 
-# ... (Existing functions: delete_pages, insert_page, compress_pdf, rearrange_pdf) ...
+def parse_page_numbers(text, page_count):
+    """Parse page numbers like "1,3-5" into a list of 1-based page numbers, in order."""
+    numbers = []
+    for part in re.split(r"[,\s]+", text.strip()):
+        if not part:
+            continue
+        match = re.fullmatch(r"(\d+)(?:-(\d+))?", part)
+        if not match:
+            raise ValueError(f"Invalid page number or range: {part}")
+        first, last = int(match[1]), int(match[2] or match[1])
+        if not 1 <= first <= last <= page_count:
+            raise ValueError(f"Pages must be between 1 and {page_count}.")
+        numbers.extend(range(first, last + 1))
+    if not numbers:
+        raise ValueError("No page numbers given.")
+    return numbers
+
+def parse_pages_to_delete(text, page_count):
+    """Return the set of pages to delete, refusing to delete every page."""
+    to_delete = set(parse_page_numbers(text, page_count))
+    if len(to_delete) == page_count:
+        raise ValueError("Cannot delete every page.")
+    return to_delete
+
+def parse_page_order(text, page_count):
+    """Return a new page order, which must list every page exactly once."""
+    order = parse_page_numbers(text, page_count)
+    if sorted(order) != list(range(1, page_count + 1)):
+        raise ValueError(f"List every page from 1 to {page_count} exactly once.")
+    return order
+
+def parse_insert_position(caption, page_count):
+    """Return the page to insert after (0 = at the start); the end if no caption is given."""
+    if not caption or not caption.strip():
+        return page_count
+    if not caption.strip().isdigit() or int(caption) > page_count:
+        raise ValueError(f"The caption must be a page number from 0 to {page_count}.")
+    return int(caption)
+
+async def delete_pages(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Delete the requested pages from the PDF."""
+    user_id = update.message.from_user.id
+    data = user_data[user_id]
+    file_info = data["files"][0]
+    
+    try:
+        reader = PdfReader(file_info["path"])
+        to_delete = parse_pages_to_delete(update.message.text, len(reader.pages))
+        
+        writer = PdfWriter()
+        for page_number, page in enumerate(reader.pages, start=1):
+            if page_number not in to_delete:
+                writer.add_page(page)
+        
+        output_path = os.path.join(data["temp_dir"], f"{uuid.uuid4()}.pdf")
+        with open(output_path, "wb") as f:
+            writer.write(f)
+        file_info["path"] = output_path
+        await update.message.reply_text("✅ Pages deleted! Choose another action or get result.")
+        return ACTION
+        
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {str(e)} Try again (e.g., 1,3-5):")
+        return DELETE_PAGES
+    except Exception as e:
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+        return ACTION
+
+async def insert_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Insert the pages of an uploaded PDF after the page given in its caption."""
+    user_id = update.message.from_user.id
+    data = user_data[user_id]
+    file_info = data["files"][0]
+    
+    try:
+        reader = PdfReader(file_info["path"])
+        position = parse_insert_position(update.message.caption, len(reader.pages))
+        
+        insert_path = os.path.join(data["temp_dir"], f"{uuid.uuid4()}.pdf")
+        file = await update.message.document.get_file()
+        await file.download_to_drive(insert_path)
+        
+        writer = PdfWriter()
+        pages = list(reader.pages)
+        for page in pages[:position] + list(PdfReader(insert_path).pages) + pages[position:]:
+            writer.add_page(page)
+        output_path = os.path.join(data["temp_dir"], f"{uuid.uuid4()}.pdf")
+        with open(output_path, "wb") as f:
+            writer.write(f)
+        
+        file_info["path"] = output_path
+        await update.message.reply_text("✅ Page inserted! Choose another action or get result.")
+        return ACTION
+        
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {str(e)} Send the PDF again:")
+        return INSERT_PAGE
+    except Exception as e:
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+        return ACTION
+
+async def compress_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Compress the PDF's streams."""
+    query = update.callback_query
+    user_id = query.from_user.id
+    data = user_data[user_id]
+    file_info = data["files"][0]
+    
+    try:
+        output_path = os.path.join(data["temp_dir"], f"{uuid.uuid4()}.pdf")
+        with pikepdf.open(file_info["path"]) as pdf:
+            pdf.save(output_path, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+        
+        file_info["path"] = output_path
+        file_info["name"] = "compressed_" + file_info["name"]
+        await query.edit_message_text("✅ PDF compressed! Choose another action or get result.")
+        return ACTION
+        
+    except Exception as e:
+        await query.edit_message_text(f"❌ Compression error: {str(e)}")
+        return ACTION
+
+async def rearrange_pages(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Reorder the PDF's pages."""
+    user_id = update.message.from_user.id
+    data = user_data[user_id]
+    file_info = data["files"][0]
+    
+    try:
+        reader = PdfReader(file_info["path"])
+        order = parse_page_order(update.message.text, len(reader.pages))
+        
+        writer = PdfWriter()
+        for page_number in order:
+            writer.add_page(reader.pages[page_number - 1])
+        
+        output_path = os.path.join(data["temp_dir"], f"{uuid.uuid4()}.pdf")
+        with open(output_path, "wb") as f:
+            writer.write(f)
+        file_info["path"] = output_path
+        await update.message.reply_text("✅ Pages rearranged! Choose another action or get result.")
+        return ACTION
+        
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {str(e)} Try again (e.g., 3,1,2):")
+        return REARRANGE
+    except Exception as e:
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+        return ACTION
 
 async def ocr_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Perform OCR on PDF or image."""
@@ -251,17 +518,29 @@ async def ocr_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = query.from_user.id
     data = user_data[user_id]
     file_info = data["files"][0]
+    ticket = None
     
     try:
+        ticket = await admit_ocr_job([file_info])
+        if not ticket["admitted"]:
+            await query.edit_message_text(f"❌ OCR rejected: {ticket['reason']}")
+            return ACTION
+        if ticket["downgraded"]:
+            await edit_progress(query, context, f"⚠️ {ticket['reason']} Processing at reduced resolution...")
+        
+        loop = asyncio.get_running_loop()
         if file_info["type"] == "pdf":
-            # Convert PDF to images
-            images = convert_from_path(file_info["path"], dpi=300)
+            dpis = ticket["dpis"][file_info["path"]]
+            file_info.setdefault("metrics", {})["ocr_dpi"] = dpis
+            logger.info("OCR render DPI for user %s: %s", user_id, dpis)
             output_path = os.path.join(data["temp_dir"], "ocr_output.pdf")
-            
-            # Perform OCR on each image
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                futures = [executor.submit(process_ocr_page, image) for image in images]
-                pdf_pages = [f.result() for f in concurrent.futures.as_completed(futures)]
+
+            # Render and OCR each page on the OCR threads
+            page_tasks = [
+                (process_ocr_page, file_info["path"], page_number, dpi)
+                for page_number, dpi in enumerate(dpis, start=1)
+            ]
+            pdf_pages = await run_on_ocr_threads(page_tasks, 1 if ticket["streaming"] else JOB_MAX_TASKS_IN_FLIGHT)
             
             # Combine OCR pages
             merger = PdfMerger()
@@ -271,7 +550,7 @@ async def ocr_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             merger.close()
             
         else:  # Image
-            text = pytesseract.image_to_string(Image.open(file_info["path"]))
+            text = await loop.run_in_executor(ocr_executor, ocr_image_text, file_info["path"])
             output_path = os.path.join(data["temp_dir"], "ocr_text.txt")
             with open(output_path, "w") as f:
                 f.write(text)
@@ -283,15 +562,327 @@ async def ocr_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         await query.edit_message_text("✅ OCR completed! Choose another action or get result.")
         return ACTION
         
+    except JobLimitError as e:
+        await query.edit_message_text(f"❌ OCR stopped: {str(e)}")
+        return ACTION
     except Exception as e:
         await query.edit_message_text(f"❌ OCR error: {str(e)}")
         return ACTION
+    finally:
+        if ticket:
+            release_job(ticket)
+
+def process_ocr_page(pdf_path, page_number, dpi):
+    """Render a single page at the given DPI and OCR it."""
+    with tempfile.TemporaryDirectory(prefix="pdfbot_ocr_") as work_dir:
+        base = os.path.join(work_dir, "page")
+        run_limited([
+            "pdftoppm", "-r", str(dpi), "-f", str(page_number), "-l", str(page_number),
+            "-singlefile", "-png", pdf_path, base
+        ])
+        run_limited([pytesseract.pytesseract.tesseract_cmd, base + ".png", base, "pdf"])
+        with open(base + ".pdf", "rb") as f:
+            return io.BytesIO(f.read())
+
+def ocr_image_text(image_path):
+    """OCR an image file to plain text."""
+    return run_limited([pytesseract.pytesseract.tesseract_cmd, image_path, "stdout"]).decode()
+
+async def run_on_ocr_threads(tasks, max_in_flight):
+    """Run (func, *args) tasks on the OCR threads and return their results in order.
+
+    At most max_in_flight of a job's tasks are queued or running at once,
+    so a large job can't hold up jobs that arrive after it. If a task
+    fails, the ones not yet started are dropped and the running ones are
+    waited for before the error is raised, so nothing of the job is still
+    running once its ticket is released.
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+    submitted = []
+    stopped = False
+    
+    async def run(task):
+        nonlocal stopped
+        async with semaphore:
+            if stopped:  # Another task failed; its slot must not start a new one
+                return None
+            future = ocr_executor.submit(*task)
+            submitted.append(future)
+            try:
+                return await asyncio.wrap_future(future)
+            except BaseException:
+                stopped = True
+                raise
+    
+    runs = [asyncio.ensure_future(run(task)) for task in tasks]
+    try:
+        return await asyncio.gather(*runs)
+    except BaseException:
+        for task in runs:
+            task.cancel()
+        for future in submitted:
+            future.cancel()
+        await asyncio.get_running_loop().run_in_executor(None, concurrent.futures.wait, submitted)
+        raise
+
+class JobLimitError(Exception):
+    """Raised when an OCR job exceeds its CPU time, memory or time limit."""
+
+def limit_child_resources(pid):
+    """Cap CPU time and address space of a running pdftoppm/Tesseract process."""
+    if resource is None or not hasattr(resource, "prlimit"):  # prlimit is Linux only
+        return
+    limit = WORKER_MEMORY_MB * 1024 * 1024
+    try:
+        resource.prlimit(pid, resource.RLIMIT_CPU, (WORKER_CPU_SECONDS, WORKER_CPU_SECONDS + 5))
+        resource.prlimit(pid, resource.RLIMIT_AS, (limit, limit))
+    except ProcessLookupError:
+        pass  # Already exited
+
+def run_limited(command):
+    """Run an OCR tool under the per-page limits and return its stdout.
+
+    Hitting a limit raises JobLimitError; any other failure raises
+    RuntimeError with the tool's error output. The limits are applied to
+    the started process rather than in a preexec_fn, which is not safe to
+    use from the OCR threads.
+    """
+    tool = os.path.basename(command[0])
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env={**os.environ, "OMP_THREAD_LIMIT": "1"},  # One core per Tesseract run
+    )
+    limit_child_resources(process.pid)
+    try:
+        stdout, stderr = process.communicate(timeout=WORKER_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        raise JobLimitError(f"a page took longer than {WORKER_TIMEOUT_SECONDS}s to process.")
+    
+    if process.returncode == 0:
+        return stdout
+    stderr = stderr.decode(errors="replace").strip()
+    if process.returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+        raise JobLimitError(f"a page exceeded the limit of {WORKER_CPU_SECONDS}s CPU time.")
+    if process.returncode in (-signal.SIGABRT, -signal.SIGSEGV) or "alloc" in stderr.lower() or "memory" in stderr.lower():
+        raise JobLimitError(f"a page exceeded the memory limit of {WORKER_MEMORY_MB} MB.")
+    raise RuntimeError(f"{tool} failed: {stderr or process.returncode}")
 
-def process_ocr_page(image):
-    """Process a single page for OCR."""
-    text = pytesseract.image_to_pdf_or_hocr(image, extension='pdf')
-    pdf_reader = PdfReader(io.BytesIO(text))
-    return io.BytesIO(text)
+async def admit_ocr_job(file_infos):
+    """Estimate an OCR job's cost off the event loop and decide whether it may run."""
+    loop = asyncio.get_running_loop()
+    return admit_job(await loop.run_in_executor(None, estimate_job_cost, file_infos))
+
+def estimate_job_cost(file_infos):
+    """Estimate the cost of an OCR job before any rendering starts.
+
+    Returns the total file size and page count, plus the planned render DPI
+    and area (in square inches) of every PDF page so the rendered pixel
+    count can be recomputed for a lower DPI. Files are only opened once the
+    total size is known to be within JOB_MAX_FILE_MB.
+    """
+    cost = {"bytes": 0, "pages": 0, "dpis": {}, "page_areas": {}, "image_megapixels": 0.0}
+    cost["bytes"] = sum(os.path.getsize(file_info["path"]) for file_info in file_infos)
+    if cost["bytes"] > JOB_MAX_FILE_MB * 1024 * 1024:
+        return cost
+    
+    for file_info in file_infos:
+        path = file_info["path"]
+        if file_info["type"] == "pdf":
+            with pikepdf.open(path) as pdf:
+                cost["page_areas"][path] = [
+                    float(page.mediabox[2] - page.mediabox[0]) * float(page.mediabox[3] - page.mediabox[1]) / 72 ** 2
+                    for page in pdf.pages
+                ]
+            cost["pages"] += len(cost["page_areas"][path])
+            if cost["pages"] <= JOB_MAX_PAGES:
+                cost["dpis"][path] = choose_ocr_dpis(path)
+        elif file_info["type"] == "image":
+            with Image.open(path) as image:
+                cost["image_megapixels"] += image.width * image.height / 1e6
+            cost["pages"] += 1
+    return cost
+
+def job_megapixels(cost, dpis):
+    """Return the rendered megapixels of a job at the given per-file DPIs."""
+    megapixels = cost["image_megapixels"]
+    for path, areas in cost["page_areas"].items():
+        megapixels += sum(area * dpi ** 2 for area, dpi in zip(areas, dpis[path])) / 1e6
+    return megapixels
+
+def admit_job(cost):
+    """Decide whether an OCR job may run, and how.
+
+    Jobs over the file size or page limits are rejected. Jobs that would
+    render too many pixels are downgraded to JOB_DOWNGRADE_DPI and run one
+    page at a time; if that is still too much, or the host is already busy
+    with other large jobs, they are rejected. Admitted jobs must be passed
+    to release_job() when done.
+    """
+    ticket = {"admitted": False, "downgraded": False, "streaming": False,
+              "dpis": cost["dpis"], "megapixels": 0.0, "reason": ""}
+    
+    size_mb = cost["bytes"] / (1024 * 1024)
+    if size_mb > JOB_MAX_FILE_MB:
+        ticket["reason"] = f"file is too large ({size_mb:.1f} MB, limit {JOB_MAX_FILE_MB} MB)."
+        return ticket
+    if cost["pages"] > JOB_MAX_PAGES:
+        ticket["reason"] = f"too many pages ({cost['pages']}, limit {JOB_MAX_PAGES})."
+        return ticket
+    
+    megapixels = job_megapixels(cost, cost["dpis"])
+    if megapixels > JOB_MAX_MEGAPIXELS:
+        ticket["dpis"] = {
+            path: [min(dpi, JOB_DOWNGRADE_DPI) for dpi in dpis]
+            for path, dpis in cost["dpis"].items()
+        }
+        megapixels = job_megapixels(cost, ticket["dpis"])
+        if megapixels > JOB_MAX_MEGAPIXELS:
+            ticket["reason"] = "document is too large to OCR."
+            return ticket
+        ticket["downgraded"] = True
+        ticket["streaming"] = True
+        ticket["reason"] = "Large document."
+    
+    global active_job_megapixels
+    with job_lock:
+        # A lone job is always admitted so nothing within the per-job limit starves
+        if active_job_megapixels and active_job_megapixels + megapixels > GLOBAL_MAX_MEGAPIXELS:
+            ticket["reason"] = "the server is busy with other large jobs, please try again shortly."
+            return ticket
+        active_job_megapixels += megapixels
+    
+    ticket["admitted"] = True
+    ticket["megapixels"] = megapixels
+    logger.info("Admitted OCR job: %.0f MP, %d pages, downgraded=%s",
+                megapixels, cost["pages"], ticket["downgraded"])
+    return ticket
+
+def release_job(ticket):
+    """Return an admitted job's share of the global pixel budget."""
+    global active_job_megapixels
+    if ticket["admitted"]:
+        with job_lock:
+            active_job_megapixels = max(active_job_megapixels - ticket["megapixels"], 0.0)
+        ticket["admitted"] = False
+
+def limit_worker_memory():
+    """Cap the address space of a worker process."""
+    if resource is not None:
+        limit = WORKER_MEMORY_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def run_with_cpu_limit(func, *args):
+    """Run func in a worker process with WORKER_CPU_SECONDS of CPU time on top of what it has used."""
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(usage.ru_utime + usage.ru_stime) + WORKER_CPU_SECONDS
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    return func(*args)
+
+async def run_in_worker_pool(func, arg_lists):
+    """Run func(*args) for every args in arg_lists in worker processes.
+
+    Each call gets a pool of its own, so a worker killed by its resource
+    limits only breaks this call's tasks (with BrokenProcessPool). Returns
+    the results in order, with exceptions in place of failed results.
+    """
+    loop = asyncio.get_running_loop()
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=max(min(WORKER_PROCESSES, len(arg_lists)), 1),
+        mp_context=worker_mp_context,
+        initializer=limit_worker_memory
+    )
+    try:
+        return await asyncio.gather(
+            *(loop.run_in_executor(executor, run_with_cpu_limit, func, *args) for args in arg_lists),
+            return_exceptions=True
+        )
+    finally:
+        executor.shutdown(wait=False)
+
+def choose_ocr_dpis(pdf_path):
+    """Pick a render DPI for every page of a PDF.
+
+    Pages with text are rendered so the smallest font reaches
+    OCR_TARGET_GLYPH_PX; scanned pages are rendered at the resolution of
+    their embedded image, since going above it adds pixels but no detail.
+    """
+    dpis = []
+    with pikepdf.open(pdf_path) as pdf:
+        for page in pdf.pages:
+            font_size, image_dpi = measure_page(page)
+            if font_size:
+                dpi = OCR_TARGET_GLYPH_PX * 72 / font_size
+            elif image_dpi:
+                dpi = image_dpi
+            else:
+                dpi = OCR_DEFAULT_DPI
+            dpis.append(int(min(max(dpi, OCR_MIN_DPI), OCR_MAX_DPI)))
+    return dpis
+
+def multiply_matrices(m, n):
+    """Multiply two PDF matrices given as (a, b, c, d, e, f)."""
+    return (
+        m[0] * n[0] + m[1] * n[2],
+        m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2],
+        m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4],
+        m[4] * n[1] + m[5] * n[3] + n[5],
+    )
+
+def measure_page(page):
+    """Return (smallest font size in points, resolution of the sharpest image) for a page.
+
+    Font sizes are taken at text-showing operators from the current Tf size
+    scaled by the text and transformation matrices; image resolution uses
+    the width each image is drawn at. Either value is None when the page has
+    no text or no images. Content inside form XObjects is not inspected.
+    """
+    identity = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+    ctm, font_size, state_stack = identity, None, []
+    text_matrix = identity
+    font_sizes, image_dpis = [], []
+    image_names = {str(name): int(image.get("/Width", 0)) for name, image in page.images.items()}
+    try:
+        operations = pikepdf.parse_content_stream(page, "q Q cm BT Tf Tm Tj TJ ' \" Do")
+    except pikepdf.PdfError:
+        return None, None
+    
+    for operands, operator in operations:
+        operator = str(operator)
+        # The CTM and the Tf font size are graphics state, saved and restored by q/Q
+        if operator == "q":
+            state_stack.append((ctm, font_size))
+        elif operator == "Q":
+            ctm, font_size = state_stack.pop() if state_stack else (identity, None)
+        elif operator == "cm":
+            ctm = multiply_matrices(tuple(float(value) for value in operands), ctm)
+        elif operator == "BT":
+            text_matrix = identity
+        elif operator == "Tf":
+            font_size = abs(float(operands[1]))
+        elif operator == "Tm":
+            text_matrix = tuple(float(value) for value in operands)
+        elif operator == "Do":
+            width_px = image_names.get(str(operands[0]))
+            placed_width_pt = (ctm[0] ** 2 + ctm[1] ** 2) ** 0.5
+            if width_px and placed_width_pt > 0:
+                image_dpis.append(width_px / (placed_width_pt / 72))
+        elif font_size:  # Tj, TJ, ' or "
+            matrix = multiply_matrices(text_matrix, ctm)
+            size = font_size * (matrix[2] ** 2 + matrix[3] ** 2) ** 0.5
+            if size >= 1:
+                font_sizes.append(size)
+    
+    return (min(font_sizes) if font_sizes else None), (max(image_dpis) if image_dpis else None)
 
 async def encrypt_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Encrypt or decrypt PDF."""
@@ -308,13 +899,17 @@ async def encrypt_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     file_info = data["files"][0]
     
     try:
-        if operation == "encrypt":
+        if operation in ("encrypt", "encrypt-restricted"):
+            restricted = operation == "encrypt-restricted"
             with pikepdf.open(file_info["path"]) as pdf:
                 output_path = os.path.join(data["temp_dir"], "encrypted.pdf")
-                pdf.save(output_path, encryption=pikepdf.Encryption(owner=password, user=password))
+                pdf.save(output_path, encryption=pdf_encryption(password, restricted))
                 file_info["path"] = output_path
                 file_info["name"] = "encrypted_" + file_info["name"]
-                await update.message.reply_text("✅ PDF encrypted! Choose another action or get result.")
+                await update.message.reply_text(
+                    f"✅ PDF encrypted{' (copying and editing blocked)' if restricted else ''}! "
+                    "Choose another action or get result."
+                )
                 
         elif operation == "decrypt":
             with pikepdf.open(file_info["path"], password=password) as pdf:
@@ -325,7 +920,7 @@ async def encrypt_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
                 await update.message.reply_text("✅ PDF decrypted! Choose another action or get result.")
                 
         else:
-            await update.message.reply_text("❌ Invalid operation. Use 'encrypt' or 'decrypt'.")
+            await update.message.reply_text("❌ Invalid operation. Use 'encrypt', 'encrypt-restricted' or 'decrypt'.")
             return ENCRYPT
             
         return ACTION
@@ -334,6 +929,19 @@ async def encrypt_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         await update.message.reply_text(f"❌ Error: {str(e)}")
         return ACTION
 
+def pdf_encryption(password, restricted=False):
+    """Return the encryption settings for a PDF protected by password.
+
+    By default the password is also the owner password and nothing is
+    restricted. Restricted PDFs get PDF_PERMISSIONS and an owner password
+    nobody knows, so the restrictions can't be lifted.
+    """
+    if restricted:
+        return pikepdf.Encryption(
+            owner=secrets.token_urlsafe(32), user=password, R=6, aes=True, allow=PDF_PERMISSIONS
+        )
+    return pikepdf.Encryption(owner=password, user=password, R=6, aes=True)
+
 async def handle_watermark(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle watermark selection."""
     query = update.callback_query
@@ -361,7 +969,7 @@ async def apply_watermark(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             writer = PdfWriter()
             
             # Create watermark
-            watermark_pdf = create_watermark(update, context, len(reader.pages))
+            watermark_pdf = await create_watermark(update, context, len(reader.pages))
             watermark_reader = PdfReader(watermark_pdf)
             
             # Apply watermark to each page
@@ -377,7 +985,7 @@ async def apply_watermark(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 
         else:  # Image
             image = Image.open(file_info["path"])
-            watermark_image = create_image_watermark(update, context)
+            watermark_image = await create_image_watermark(update, context)
             watermarked = Image.new('RGBA', image.size)
             watermarked.paste(image, (0, 0))
             watermarked.paste(watermark_image, (0, 0), watermark_image)
@@ -394,7 +1002,7 @@ async def apply_watermark(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text(f"❌ Watermark error: {str(e)}")
         return ACTION
 
-def create_watermark(update, context, page_count):
+async def create_watermark(update, context, page_count):
     """Create PDF watermark."""
     user_id = update.message.from_user.id
     data = user_data[user_id]
@@ -429,7 +1037,7 @@ def create_watermark(update, context, page_count):
             file = update.message.photo[-1]
         
         watermark_path = os.path.join(data["temp_dir"], "watermark_image")
-        await file.get_file().download_to_drive(watermark_path)
+        await (await file.get_file()).download_to_drive(watermark_path)
         
         packet = io.BytesIO()
         can = canvas.Canvas(packet, pagesize=letter)
@@ -452,7 +1060,7 @@ def create_watermark(update, context, page_count):
         can.save()
         return packet
 
-def create_image_watermark(update, context):
+async def create_image_watermark(update, context):
     """Create image watermark."""
     if update.message.text:
         # Create text watermark image
@@ -471,7 +1079,7 @@ def create_image_watermark(update, context):
             file = update.message.photo[-1]
         
         watermark_path = os.path.join(data["temp_dir"], "watermark_image")
-        await file.get_file().download_to_drive(watermark_path)
+        await (await file.get_file()).download_to_drive(watermark_path)
         return Image.open(watermark_path).convert("RGBA")
 
 async def cloud_save(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -569,6 +1177,8 @@ async def batch_process(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     keyboard = [
         [InlineKeyboardButton("🗜️ Compress All", callback_data="batch_compress")],
         [InlineKeyboardButton("🔒 Encrypt All", callback_data="batch_encrypt")],
+        [InlineKeyboardButton("🔏 Encrypt All (no copy/edit)", callback_data="batch_encrypt_restricted")],
+        [InlineKeyboardButton("🔓 Decrypt All", callback_data="batch_decrypt")],
         [InlineKeyboardButton("🔍 OCR All", callback_data="batch_ocr")],
         [InlineKeyboardButton("📄 Merge to Single PDF", callback_data="batch_merge")]
     ]
@@ -597,20 +1207,38 @@ async def handle_batch_action(update: Update, context: ContextTypes.DEFAULT_TYPE
                         file_info["path"] = output_path
             await query.edit_message_text("✅ All PDFs compressed!")
             
-        elif action == "batch_encrypt":
+        elif action in ("batch_encrypt", "batch_encrypt_restricted"):
             await query.edit_message_text("Enter password for encryption:")
             data["batch_action"] = "encrypt"
+            data["batch_restricted"] = action == "batch_encrypt_restricted"
+            return BATCH_PROCESS
+            
+        elif action == "batch_decrypt":
+            await query.edit_message_text("Enter password for decryption:")
+            data["batch_action"] = "decrypt"
             return BATCH_PROCESS
             
         elif action == "batch_ocr":
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                futures = []
-                for file_info in data["files"]:
-                    if file_info["type"] in ["pdf", "image"]:
-                        futures.append(executor.submit(process_ocr, file_info))
+            ocr_files = [file_info for file_info in data["files"] if file_info["type"] in ["pdf", "image"]]
+            ticket = await admit_ocr_job(ocr_files)
+            if not ticket["admitted"]:
+                await query.edit_message_text(f"❌ Batch OCR rejected: {ticket['reason']}")
+                return ACTION
+            
+            try:
+                if ticket["downgraded"]:
+                    await edit_progress(query, context, f"⚠️ {ticket['reason']} Processing at reduced resolution...")
                 
-                for future in concurrent.futures.as_completed(futures):
-                    file_info = future.result()
+                # Streaming jobs OCR one file at a time
+                ocr_tasks = [
+                    (process_ocr, file_info, ticket["dpis"].get(file_info["path"])) for file_info in ocr_files
+                ]
+                await run_on_ocr_threads(ocr_tasks, 1 if ticket["streaming"] else JOB_MAX_TASKS_IN_FLIGHT)
+            except JobLimitError as e:
+                await query.edit_message_text(f"❌ Batch OCR stopped: {str(e)}")
+                return ACTION
+            finally:
+                release_job(ticket)
             await query.edit_message_text("✅ OCR completed on all files!")
             
         elif action == "batch_merge":
@@ -641,21 +1269,95 @@ async def handle_batch_action(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.edit_message_text(f"❌ Batch processing error: {str(e)}")
         return ACTION
 
-def process_ocr(file_info):
+async def handle_batch_password(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Encrypt or decrypt all PDFs in the batch in parallel."""
+    user_id = update.message.from_user.id
+    data = user_data[user_id]
+    operation = data.get("batch_action")
+    password = update.message.text.strip()
+    
+    if operation not in ("encrypt", "decrypt"):
+        await update.message.reply_text("❌ Choose a batch operation first.")
+        return BATCH_PROCESS
+    if not password:
+        await update.message.reply_text(f"❌ Enter a password for {operation}ion:")
+        return BATCH_PROCESS
+    
+    data.pop("batch_action")
+    restricted = data.pop("batch_restricted", False)
+    pdf_files = [file_info for file_info in data["files"] if file_info["type"] == "pdf"]
+    await send_progress(update, context, f"⏳ {operation.capitalize()}ing {len(pdf_files)} PDFs...")
+    
+    # Each file is read from and written to disk inside a worker process
+    output_paths = [
+        os.path.join(data["temp_dir"], f"{operation}ed_{uuid.uuid4().hex}.pdf") for _ in pdf_files
+    ]
+    started = time.perf_counter()
+    results = await run_in_worker_pool(crypt_pdf_file, [
+        (file_info["path"], output_path, operation, password, restricted)
+        for file_info, output_path in zip(pdf_files, output_paths)
+    ])
+    elapsed = time.perf_counter() - started
+    
+    lines = []
+    for file_info, output_path, result in zip(pdf_files, output_paths, results):
+        if isinstance(result, BrokenProcessPool):
+            # Any file of the batch may have killed the worker, so don't blame this one
+            lines.append(f"❌ {file_info['name']}: server error, a worker process stopped unexpectedly")
+        elif isinstance(result, Exception):
+            lines.append(f"❌ {file_info['name']}: {str(result)}")
+        else:
+            lines.append(f"✅ {file_info['name']}: {result:.2f}s")
+            file_info["path"] = output_path
+            file_info["name"] = f"{operation}ed_" + file_info["name"]
+    
+    succeeded = sum(1 for line in lines if line.startswith("✅"))
+    summary = (
+        f"{'✅' if succeeded == len(pdf_files) else '⚠️'} {succeeded}/{len(pdf_files)} PDFs "
+        f"{operation}ed in {elapsed:.1f}s\n"
+    )
+    await update.message.reply_text(truncate_lines(summary, lines))
+    return ACTION
+
+def truncate_lines(header, lines, limit=MAX_MESSAGE_LENGTH):
+    """Join a header and lines into one message, dropping the lines that don't fit."""
+    text = header
+    for shown, line in enumerate(lines):
+        rest = len(lines) - shown
+        # Leave room for the "... and N more" line in case later lines don't fit
+        more = f"\n... and {rest} more" if rest > 1 else ""
+        if len(text) + 1 + len(line) + len(more) > limit:
+            return text + f"\n... and {rest} more"
+        text += "\n" + line
+    return text
+
+def crypt_pdf_file(source_path, output_path, operation, password, restricted=False):
+    """Encrypt or decrypt one PDF from disk to disk and return the time it took."""
+    started = time.perf_counter()
+    if operation == "encrypt":
+        with pikepdf.open(source_path) as pdf:
+            pdf.save(output_path, encryption=pdf_encryption(password, restricted))
+    else:
+        with pikepdf.open(source_path, password=password) as pdf:
+            pdf.save(output_path)
+    return time.perf_counter() - started
+
+def process_ocr(file_info, dpis=None):
     """Process OCR for a single file in batch."""
     if file_info["type"] == "pdf":
-        images = convert_from_path(file_info["path"], dpi=300)
+        dpis = dpis or choose_ocr_dpis(file_info["path"])
+        file_info.setdefault("metrics", {})["ocr_dpi"] = dpis
+        logger.info("OCR render DPI for %s: %s", file_info["name"], dpis)
         ocr_path = os.path.join(os.path.dirname(file_info["path"]), f"ocr_{file_info['name']}")
         with open(ocr_path, "wb") as f:
             with PdfWriter() as writer:
-                for image in images:
-                    text = pytesseract.image_to_pdf_or_hocr(image, extension='pdf')
-                    reader = PdfReader(io.BytesIO(text))
+                for page_number, dpi in enumerate(dpis, start=1):
+                    reader = PdfReader(process_ocr_page(file_info["path"], page_number, dpi))
                     writer.add_page(reader.pages[0])
                 writer.write(f)
         file_info["path"] = ocr_path
     else:  # Image
-        text = pytesseract.image_to_string(Image.open(file_info["path"]))
+        text = ocr_image_text(file_info["path"])
         ocr_path = os.path.join(os.path.dirname(file_info["path"]), f"ocr_{os.path.splitext(file_info['name'])[0]}.txt")
         with open(ocr_path, "w") as f:
             f.write(text)
@@ -699,13 +1401,285 @@ def convert_image_to_pdf_sync(file_info):
     image.save(pdf_path, "PDF", resolution=100.0)
     return pdf_path
 
-# ... (Existing functions: finish_editing, cancel) ...
+def clear_user_data(user_id):
+    """Remove a user's temporary files and session."""
+    data = user_data.pop(user_id, None)
+    if data:
+        shutil.rmtree(data["temp_dir"], ignore_errors=True)
 
-def main() -> None:
-    """Start the bot."""
-    TOKEN = 7494858344:AAHrPJcxrAztwuERShGWQoOQ42qpePGxj18
+async def finish_editing(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Send the resulting files and end the conversation."""
+    query = update.callback_query
+    user_id = query.from_user.id
+    data = user_data[user_id]
     
-    app = Application.builder().token(TOKEN).build()
+    try:
+        for file_info in data["files"]:
+            with open(file_info["path"], "rb") as f:
+                await query.message.reply_document(document=f, filename=file_info["name"])
+        await query.edit_message_text("✅ Done! Send /start to process another file.")
+    except Exception as e:
+        await query.edit_message_text(f"❌ Could not send the result: {str(e)}")
+        return ACTION
+    
+    clear_user_data(user_id)
+    return ConversationHandler.END
+
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Cancel the conversation and discard the user's files."""
+    clear_user_data(update.effective_user.id)
+    await update.message.reply_text("❌ Cancelled. Send /start to begin again.")
+    return ConversationHandler.END
+
+class OutboundScheduler(BaseRateLimiter):
+    """Queue outbound Bot API requests and send them within Telegram's flood limits.
+
+    Requests addressed to a chat are sent at most once per chat_interval per
+    chat and global_rate times per second overall. Pending edits of the same
+    message are coalesced so only the latest one is sent, and final results
+    go ahead of progress updates. Mark a request as a progress update by
+    calling a context.bot method with rate_limit_args={"priority": PRIORITY_PROGRESS}
+    (see send_progress and edit_progress).
+
+    Each chat has its own priority queue. Chats allowed to send are kept in
+    a heap ordered by their most urgent request, and chats still waiting
+    out chat_interval in a heap ordered by when they may send again, so
+    picking the next request is O(log n).
+    """
+
+    def __init__(self, global_rate=GLOBAL_SENDS_PER_SECOND, chat_interval=CHAT_SEND_INTERVAL):
+        self.global_interval = 1 / global_rate
+        self.chat_interval = chat_interval
+        self._chats = {}  # chat_id -> {"queue": heap of (priority, seq, request), "ready_at", "waiting"}
+        self._ready = []  # Heap of (priority, seq, chat_id): head request of each chat that may send
+        self._waiting = []  # Heap of (ready_at, chat_id): chats with requests waiting out chat_interval
+        self._pending_edits = {}
+        self._next_send_at = 0.0
+        self._seq = itertools.count()
+        self._sending = set()
+        self._wakeup = None
+        self._worker = None
+
+    async def initialize(self) -> None:
+        # The application and the updater both initialize the bot, and with it the rate limiter
+        if self._worker is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+
+    async def shutdown(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+        for chat in self._chats.values():
+            for _, _, request in chat["queue"]:
+                for future in request["futures"]:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Outbound scheduler was shut down"))
+        self._chats.clear()
+        self._ready.clear()
+        self._waiting.clear()
+        self._pending_edits.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None:  # getUpdates, answerCallbackQuery, getFile, ...
+            return await callback(*args, **kwargs)
+        
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_RESULT)
+        future = asyncio.get_running_loop().create_future()
+        key = (chat_id, data["message_id"]) if endpoint in EDIT_ENDPOINTS and data.get("message_id") else None
+        request = self._pending_edits.get(key) if key else None
+        
+        if request is not None:
+            # Only the latest edit is sent; earlier callers get its result
+            request.update(callback=callback, args=args, kwargs=kwargs)
+            request["futures"].append(future)
+            if priority < request["priority"]:
+                request["priority"] = priority
+                self._enqueue(request)
+        else:
+            request = {
+                "chat_id": chat_id, "key": key, "priority": priority, "sent": False,
+                "callback": callback, "args": args, "kwargs": kwargs, "futures": [future]
+            }
+            if key:
+                self._pending_edits[key] = request
+            self._enqueue(request)
+        
+        return await future
+
+    def _enqueue(self, request):
+        """Add a request to its chat's queue and make sure the chat is scheduled."""
+        chat = self._chats.setdefault(request["chat_id"], {"queue": [], "ready_at": 0.0, "waiting": False})
+        entry = (request["priority"], next(self._seq), request)
+        heapq.heappush(chat["queue"], entry)
+        if chat["waiting"]:
+            pass  # Scheduled once its interval is over
+        elif chat["ready_at"] > asyncio.get_running_loop().time():
+            chat["waiting"] = True
+            heapq.heappush(self._waiting, (chat["ready_at"], request["chat_id"]))
+        elif chat["queue"][0] is entry:
+            heapq.heappush(self._ready, (entry[0], entry[1], request["chat_id"]))
+        self._wakeup.set()
+
+    def _head(self, chat):
+        """Return a chat's most urgent unsent queue entry, dropping superseded ones."""
+        queue = chat["queue"]
+        while queue and queue[0][2]["sent"]:
+            heapq.heappop(queue)
+        return queue[0] if queue else None
+
+    def _pop_ready(self, now):
+        """Pop the most urgent request whose chat may send now, or return how long to wait."""
+        while self._waiting and self._waiting[0][0] <= now:
+            _, chat_id = heapq.heappop(self._waiting)
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                continue
+            chat["waiting"] = False
+            head = self._head(chat)
+            if head:
+                heapq.heappush(self._ready, (head[0], head[1], chat_id))
+        
+        if now < self._next_send_at:
+            return None, self._next_send_at - now
+        
+        while self._ready:
+            priority, seq, chat_id = heapq.heappop(self._ready)
+            chat = self._chats.get(chat_id)
+            head = self._head(chat) if chat else None
+            if head is None or head[:2] != (priority, seq) or chat["waiting"]:
+                continue  # Stale entry: the chat's head changed or it already sent
+            heapq.heappop(chat["queue"])
+            return head[2], None
+        
+        if self._waiting:
+            return None, max(self._waiting[0][0] - now, 0)
+        return None, None
+
+    async def _run(self):
+        """Send queued requests as their chat and the global limit allow."""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            request, wait = self._pop_ready(now)
+            if request is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            request["sent"] = True
+            if request["key"]:
+                self._pending_edits.pop(request["key"], None)
+            chat = self._chats[request["chat_id"]]
+            chat["ready_at"] = now + self.chat_interval
+            if self._head(chat):
+                chat["waiting"] = True
+                heapq.heappush(self._waiting, (chat["ready_at"], request["chat_id"]))
+            self._next_send_at = now + self.global_interval
+            
+            task = asyncio.create_task(self._send(request))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+            
+            if len(self._chats) > 10000:
+                self._chats = {
+                    chat_id: chat for chat_id, chat in self._chats.items()
+                    if chat["queue"] or chat["ready_at"] > now
+                }
+
+    async def _send(self, request):
+        """Send one request and resolve everyone waiting on it."""
+        try:
+            result = await request["callback"](*request["args"], **request["kwargs"])
+        except RetryAfter as e:
+            # Flood limit hit: pause all sends, then retry this request
+            loop = asyncio.get_running_loop()
+            self._next_send_at = max(self._next_send_at, loop.time() + e.retry_after)
+            newer = self._pending_edits.get(request["key"]) if request["key"] else None
+            if newer is not None:
+                newer["futures"].extend(request["futures"])
+            else:
+                request["sent"] = False
+                if request["key"]:
+                    self._pending_edits[request["key"]] = request
+                self._enqueue(request)
+            self._wakeup.set()
+            return
+        except Exception as e:
+            for future in request["futures"]:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for future in request["futures"]:
+            if not future.done():
+                future.set_result(result)
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Handle updates from different users concurrently, but one at a time per user.
+
+    The ConversationHandler reads a user's state when an update arrives, so
+    a second update from the same user must wait until the handler for the
+    first one has returned its new state. Otherwise e.g. "Get Result" could
+    run while OCR is still working on the same files.
+    """
+
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self._users = {}  # user_id -> [lock, updates holding or waiting for it]
+
+    async def do_process_update(self, update, coroutine):
+        user = getattr(update, "effective_user", None)
+        if user is None:
+            await coroutine
+            return
+        
+        entry = self._users.setdefault(user.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._users[user.id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+def build_application(token, base_url=None, base_file_url=None):
+    """Build the bot application.
+
+    base_url and base_file_url point the bot at a different Bot API server,
+    e.g. a local one for load testing.
+    """
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(PerUserUpdateProcessor())
+        .rate_limiter(OutboundScheduler())
+        .request(HTTPXRequest(connection_pool_size=OUTBOUND_POOL_SIZE))
+        .get_updates_request(HTTPXRequest())
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    if base_file_url:
+        builder = builder.base_file_url(base_file_url)
+    app = builder.build()
     
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
@@ -742,7 +1716,10 @@ def main() -> None:
             ],
             BATCH_PROCESS: [
                 CallbackQueryHandler(handle_batch_action),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_batch_password)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_batch_password),
+                MessageHandler(filters.Document.PDF | filters.Document.IMAGE, handle_document),
+                MessageHandler(filters.PHOTO, handle_photo),
+                CommandHandler("process", batch_process)
             ],
             IMAGE_TO_PDF: [
                 CallbackQueryHandler(handle_action)
@@ -752,8 +1729,17 @@ def main() -> None:
     )
     
     app.add_handler(conv_handler)
+    return app
+
+def main() -> None:
+    """Start the bot."""
+    token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    if not token:
+        logger.error("Set the TELEGRAM_BOT_TOKEN environment variable to the bot's token.")
+        return
+    
+    app = build_application(token)
     app.run_polling()
 
 if __name__ == "__main__":
-    main()
-```
\ No newline at end of file
+    main()
\ No newline at end of file
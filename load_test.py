@@ -0,0 +1,495 @@
+"""Load test for the PDF Toolbox bot.
+
+Runs the bot's real ConversationHandler (from bot_pdf.build_application)
+against a local stand-in Bot API server and simulates many concurrent
+users. Most go through start -> handle_document -> handle_action ->
+finish_editing with generated PDFs; a share of them upload several files
+and run a batch encryption instead. Reports p50/p95/p99 latency per state
+transition, throughput and error rates.
+
+The fake server enforces Telegram-style flood limits (a per-chat and a
+global token bucket) and answers with 429 "retry after" when they are
+exceeded, so the report also shows whether the bot's outbound scheduler
+stays within them.
+
+Usage:
+    python load_test.py --users 200 --ramp 20 --action ocr --batch-share 0.2
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+
+import bot_pdf
+
+logger = logging.getLogger("load_test")
+
+TOKEN = "123456:LOAD-TEST"
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "PDF Toolbox", "username": "pdf_toolbox_bot"}
+TRANSITIONS = [
+    "start", "handle_document", "handle_action", "handle_action (batch)", "handle_document (batch)",
+    "batch_process", "handle_batch_action", "handle_batch_password", "finish_editing",
+]
+DOCUMENT_SIZES = {"small": 1, "medium": 5, "large": 20}  # Pages per generated PDF
+DOCUMENT_WEIGHTS = {"small": 6, "medium": 3, "large": 1}
+
+
+class FloodLimitError(Exception):
+    """A request the fake server refuses with 429 Too Many Requests."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too Many Requests: retry after {retry_after}")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows `burst` requests at once, refilled at `rate` per second."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """Take a token; return 0 if allowed, otherwise the seconds until one is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class FakeBotAPI:
+    """Minimal in-memory Bot API: queues updates for getUpdates and records bot replies."""
+
+    def __init__(self, loop, chat_rate, chat_burst, global_rate):
+        self.loop = loop
+        self.updates = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.files = {}
+        self.inboxes = {}  # chat_id -> asyncio.Queue of bot replies
+        self.updates_ready = threading.Condition()
+        # Request statistics and flood limits, shared by the server threads
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.flood_errors = 0
+        self.send_times = {}  # chat_id -> times of accepted sends
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+
+    def push_update(self, update):
+        """Queue an update for the bot's next getUpdates call."""
+        with self.updates_ready:
+            update["update_id"] = self.next_update_id
+            self.next_update_id += 1
+            self.updates.append(update)
+            self.updates_ready.notify_all()
+
+    def add_file(self, content, extension):
+        """Store file content and return its file_id."""
+        file_id = uuid.uuid4().hex
+        self.files[file_id] = {"content": content, "path": f"documents/{file_id}{extension}"}
+        return file_id
+
+    def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = min(float(params.get("timeout") or 0), 5)
+        deadline = time.monotonic() + timeout
+        with self.updates_ready:
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+            while not self.updates and time.monotonic() < deadline:
+                self.updates_ready.wait(deadline - time.monotonic())
+            return list(self.updates)
+
+    def accept_send(self, chat_id):
+        """Apply the flood limits to a send to a chat and return the new message_id."""
+        now = time.monotonic()
+        with self.stats_lock:
+            bucket = self.chat_buckets.setdefault(chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+            retry_after = bucket.take(now) or self.global_bucket.take(now)
+            if retry_after:
+                self.flood_errors += 1
+                raise FloodLimitError(max(math.ceil(retry_after), 1))
+            self.send_times.setdefault(chat_id, []).append(now)
+            message_id = self.next_message_id
+            self.next_message_id += 1
+            return message_id
+
+    def call(self, method, params):
+        """Handle a Bot API method call and return its result."""
+        with self.stats_lock:
+            self.requests += 1
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return self.get_updates(params)
+        if method == "getFile":
+            stored = self.files[params["file_id"]]
+            return {
+                "file_id": params["file_id"],
+                "file_unique_id": params["file_id"],
+                "file_size": len(stored["content"]),
+                "file_path": stored["path"],
+            }
+        if "chat_id" not in params:  # deleteWebhook, answerCallbackQuery, ...
+            return True
+
+        chat_id = int(params["chat_id"])
+        new_message_id = self.accept_send(chat_id)
+        message_id = int(params.get("message_id") or new_message_id)
+        reply = {
+            "method": method,
+            "message_id": message_id,
+            "text": params.get("text") or params.get("caption") or "",
+            "keyboard": "reply_markup" in params,
+            "time": time.perf_counter(),
+        }
+        inbox = self.inboxes.get(chat_id)
+        if inbox is not None:
+            self.loop.call_soon_threadsafe(inbox.put_nowait, reply)
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": reply["text"] or "file",
+        }
+
+    def file_content(self, path):
+        for stored in self.files.values():
+            if stored["path"] == path:
+                return stored["content"]
+        return None
+
+    def peak_send_rates(self, window=1.0):
+        """Return the most sends seen in any `window` seconds to one chat, and overall."""
+        def peak(times):
+            times = sorted(times)
+            best, start = 0, 0
+            for end, t in enumerate(times):
+                while t - times[start] >= window:
+                    start += 1
+                best = max(best, end - start + 1)
+            return best
+
+        with self.stats_lock:
+            per_chat = max((peak(times) for times in self.send_times.values()), default=0)
+            overall = peak([t for times in self.send_times.values() for t in times])
+        return per_chat, overall
+
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    """HTTP front end for FakeBotAPI."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        # File downloads: /file/bot<token>/<file_path>
+        path = unquote(urlparse(self.path).path)
+        prefix = f"/file/bot{TOKEN}/"
+        content = self.server.api.file_content(path[len(prefix):]) if path.startswith(prefix) else None
+        if content is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        # Method calls: /bot<token>/<method>
+        method = urlparse(self.path).path.rsplit("/", 1)[-1]
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            result = self.server.api.call(method, self.parse_params(body))
+            status, payload = 200, {"ok": True, "result": result}
+        except FloodLimitError as e:
+            status, payload = 429, {
+                "ok": False, "error_code": 429, "description": str(e),
+                "parameters": {"retry_after": e.retry_after},
+            }
+        except Exception as e:
+            logger.exception("Fake Bot API failed on %s", method)
+            status, payload = 400, {"ok": False, "error_code": 400, "description": str(e)}
+
+        data = json.dumps(payload).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except ConnectionError:
+            pass  # The bot dropped a long poll while shutting down
+
+    def parse_params(self, body):
+        """Parse JSON, form-encoded or multipart request parameters."""
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
+            return json.loads(body or b"{}")
+        if content_type.startswith("multipart/form-data"):
+            message = BytesParser(policy=default_policy).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body
+            )
+            params = {}
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                if part.get_filename() is None:
+                    params[name] = part.get_content()
+            return params
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+
+def make_pdf(pages):
+    """Generate a text PDF with a mix of font sizes."""
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=letter)
+    for page in range(pages):
+        y = letter[1] - 72
+        for size in (18, 12, 10, 8):
+            can.setFont("Helvetica", size)
+            for line in range(6):
+                can.drawString(72, y, f"Page {page + 1} - invoice line {line + 1}: 1 x Widget @ 19.99 EUR")
+                y -= size * 1.5
+        can.showPage()
+    can.save()
+    return packet.getvalue()
+
+
+def user_message(user_id, message_id, **fields):
+    """Build a Message object sent by a simulated user."""
+    user = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+        "from": user,
+    }
+    message.update(fields)
+    return message
+
+
+# Which bot reply ends a transition. Progress messages never match these.
+def any_reply(reply):
+    return True
+
+
+def keyboard_reply(reply):
+    return reply["keyboard"]
+
+
+def result_reply(reply):
+    return reply["text"].startswith(("✅", "❌", "⚠️ ")) and "reduced resolution" not in reply["text"]
+
+
+def is_error(reply):
+    return reply["text"].startswith(("❌", "⚠️"))
+
+
+async def collect_replies(inbox, is_final, timeout):
+    """Wait for the bot's replies to one update, up to and including the final one."""
+    replies = []
+    deadline = time.perf_counter() + timeout
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return replies, True
+        try:
+            reply = await asyncio.wait_for(inbox.get(), remaining)
+        except asyncio.TimeoutError:
+            return replies, True
+        replies.append(reply)
+        if is_final(reply):
+            return replies, False
+
+
+async def run_user(api, user_id, documents, args, results):
+    """Drive one simulated user through a full conversation."""
+    inbox = api.inboxes[user_id]
+    message_ids = iter(range(1, 1000))
+    keyboard_message_id = None
+    size = random.choices(list(DOCUMENT_WEIGHTS), weights=list(DOCUMENT_WEIGHTS.values()))[0]
+
+    def command(text):
+        return lambda: {"message": user_message(
+            user_id, next(message_ids), text=text,
+            entities=[{"type": "bot_command", "offset": 0, "length": len(text)}]
+        )}
+
+    def text(value):
+        return lambda: {"message": user_message(user_id, next(message_ids), text=value)}
+
+    def document():
+        return lambda: {"message": user_message(
+            user_id, next(message_ids), document={
+                "file_id": documents[size], "file_unique_id": documents[size],
+                "file_name": f"{size}_invoice.pdf", "mime_type": "application/pdf",
+            }
+        )}
+
+    def press(data):
+        """A button press on the most recent keyboard."""
+        return lambda: {"callback_query": {
+            "id": uuid.uuid4().hex,
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+            "message": {
+                "message_id": keyboard_message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "menu",
+            },
+            "chat_instance": str(user_id),
+            "data": data,
+        }}
+
+    steps = [
+        ("start", command("/start"), any_reply),
+        ("handle_document", document(), keyboard_reply),
+    ]
+    if random.random() < args.batch_share:
+        steps.append(("handle_action (batch)", press("batch"), any_reply))
+        steps += [("handle_document (batch)", document(), any_reply)] * (args.batch_files - 1)
+        steps += [
+            ("batch_process", command("/process"), keyboard_reply),
+            ("handle_batch_action", press("batch_encrypt"), any_reply),
+            ("handle_batch_password", text("load-test-password"), result_reply),
+        ]
+    else:
+        steps.append(("handle_action", press(args.action), result_reply))
+    steps.append(("finish_editing", press("done"), result_reply))
+
+    await asyncio.sleep(random.uniform(0, args.ramp))
+    for transition, make_update, is_final in steps:
+        # Anything still arriving from the previous step is not this step's reply
+        while not inbox.empty():
+            inbox.get_nowait()
+
+        sent_at = time.perf_counter()
+        api.push_update(make_update())
+        replies, timed_out = await collect_replies(inbox, is_final, args.timeout)
+
+        error = None
+        if timed_out:
+            error = "timeout"
+        elif is_error(replies[-1]):
+            error = replies[-1]["text"]
+        latency = replies[-1]["time"] - sent_at if replies else None
+        results.append({"transition": transition, "latency": latency, "error": error, "user": user_id})
+        if error:
+            logger.warning("User %s failed at %s: %s", user_id, transition, error)
+            return False
+
+        if replies[-1]["keyboard"]:
+            keyboard_message_id = replies[-1]["message_id"]
+        await asyncio.sleep(random.uniform(0, args.think))
+    return True
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = max(int(round(p / 100 * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def report(results, completed, users, elapsed, api):
+    """Print latency, throughput and error rate per transition, and the flood-limit check."""
+    print(f"\n{'transition':<26}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for transition in TRANSITIONS:
+        rows = [row for row in results if row["transition"] == transition]
+        if not rows:
+            continue
+        latencies = [row["latency"] * 1000 for row in rows if row["latency"] is not None and not row["error"]]
+        errors = sum(1 for row in rows if row["error"])
+        print(
+            f"{transition:<26}{len(rows):>7}{errors:>8}"
+            f"{percentile(latencies, 50):>10.0f}{percentile(latencies, 95):>10.0f}{percentile(latencies, 99):>10.0f}"
+        )
+
+    errors = sum(1 for row in results if row["error"])
+    per_chat_peak, overall_peak = api.peak_send_rates()
+    print(f"\nUsers: {users}, completed flows: {completed} ({completed / users:.1%})")
+    print(f"Throughput: {completed / elapsed:.2f} flows/s, {len(results) / elapsed:.2f} transitions/s")
+    print(f"Error rate: {errors / max(len(results), 1):.2%} of transitions")
+    print(f"Bot API requests: {api.requests} in {elapsed:.1f}s")
+    print(f"Flood limit (429) responses: {api.flood_errors}")
+    print(f"Peak sends in 1s: {per_chat_peak} to one chat, {overall_peak} overall")
+
+
+async def run_load_test(args):
+    loop = asyncio.get_running_loop()
+    api = FakeBotAPI(loop, args.chat_rate, args.chat_burst, args.global_rate)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), FakeBotAPIHandler)
+    server.daemon_threads = True
+    server.api = api
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+
+    documents = {size: api.add_file(make_pdf(pages), ".pdf") for size, pages in DOCUMENT_SIZES.items()}
+    user_ids = [100000 + i for i in range(args.users)]
+    for user_id in user_ids:
+        api.inboxes[user_id] = asyncio.Queue()
+
+    app = bot_pdf.build_application(
+        TOKEN,
+        base_url=f"http://{host}:{port}/bot",
+        base_file_url=f"http://{host}:{port}/file/bot",
+    )
+    results = []
+    async with app:
+        await app.start()
+        await app.updater.start_polling(poll_interval=0, timeout=1)
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(run_user(api, user_id, documents, args, results) for user_id in user_ids))
+        elapsed = time.perf_counter() - started
+        await app.updater.stop()
+        await app.stop()
+    server.shutdown()
+
+    report(results, sum(outcomes), args.users, elapsed, api)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the PDF Toolbox bot against a fake Bot API.")
+    parser.add_argument("--users", type=int, default=100, help="Number of concurrent simulated users")
+    parser.add_argument("--ramp", type=float, default=10.0, help="Seconds over which users start")
+    parser.add_argument("--think", type=float, default=1.0, help="Maximum pause between a user's steps")
+    parser.add_argument("--action", default="ocr", choices=["ocr", "compress"],
+                        help="Menu action single-file users choose")
+    parser.add_argument("--batch-share", type=float, default=0.2, help="Fraction of users who batch encrypt")
+    parser.add_argument("--batch-files", type=int, default=3, help="Files each batching user uploads")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds before a transition counts as failed")
+    parser.add_argument("--chat-rate", type=float, default=1.0, help="Fake server: sends per second per chat")
+    parser.add_argument("--chat-burst", type=int, default=3, help="Fake server: burst allowed per chat")
+    parser.add_argument("--global-rate", type=float, default=30.0, help="Fake server: sends per second overall")
+    parser.add_argument("--port", type=int, default=0, help="Port for the fake Bot API (0 = any free port)")
+    args = parser.parse_args()
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(run_load_test(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import asyncio
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pikepdf
+
+from bot_pdf import crypt_pdf_file, run_in_worker_pool, truncate_lines
+
+
+def make_plain_pdf(path):
+    pdf = pikepdf.new()
+    pdf.add_blank_page()
+    pdf.save(path)
+
+
+def test_encrypted_pdf_keeps_the_password_as_owner_password(tmp_path):
+    make_plain_pdf(tmp_path / "plain.pdf")
+
+    crypt_pdf_file(tmp_path / "plain.pdf", tmp_path / "encrypted.pdf", "encrypt", "secret")
+    with pikepdf.open(tmp_path / "encrypted.pdf", password="secret") as encrypted:
+        assert encrypted.encryption.R == 6
+        assert encrypted.owner_password_matched
+        assert encrypted.allow.extract and encrypted.allow.modify_other
+
+
+def test_restricted_pdf_opens_with_the_password_but_not_as_owner(tmp_path):
+    make_plain_pdf(tmp_path / "plain.pdf")
+
+    crypt_pdf_file(tmp_path / "plain.pdf", tmp_path / "encrypted.pdf", "encrypt", "secret", True)
+    with pikepdf.open(tmp_path / "encrypted.pdf", password="secret") as encrypted:
+        assert encrypted.encryption.R == 6
+        assert not encrypted.owner_password_matched
+        assert not encrypted.allow.extract
+        assert encrypted.allow.print_highres
+
+    crypt_pdf_file(tmp_path / "encrypted.pdf", tmp_path / "decrypted.pdf", "decrypt", "secret")
+    with pikepdf.open(tmp_path / "decrypted.pdf") as decrypted:
+        assert not decrypted.is_encrypted
+
+
+def test_summary_is_truncated_to_the_message_limit():
+    lines = [f"✅ invoice_{i:04}.pdf: 0.05s" for i in range(1000)]
+    text = truncate_lines("✅ 1000/1000 PDFs encrypted in 2.1s\n", lines, limit=4096)
+    assert len(text) <= 4096
+    shown = text.count("invoice_")
+    assert text.endswith(f"... and {1000 - shown} more")
+    assert truncate_lines("header\n", lines[:3]) == "header\n\n" + "\n".join(lines[:3])
+
+
+def test_a_killed_worker_only_breaks_its_own_batch(tmp_path):
+    source = tmp_path / "plain.pdf"
+    make_plain_pdf(source)
+
+    async def scenario():
+        return await asyncio.gather(
+            run_in_worker_pool(os._exit, [(1,)]),
+            run_in_worker_pool(crypt_pdf_file, [(source, tmp_path / "encrypted.pdf", "encrypt", "secret")]),
+        )
+
+    broken, healthy = asyncio.run(scenario())
+    assert isinstance(broken[0], BrokenProcessPool)
+    assert isinstance(healthy[0], float)
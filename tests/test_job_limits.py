@@ -0,0 +1,147 @@
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+import bot_pdf
+from bot_pdf import (
+    JobLimitError, admit_job, estimate_job_cost, release_job, run_limited, run_on_ocr_threads
+)
+
+
+def test_run_limited_returns_output():
+    assert run_limited([sys.executable, "-c", "print('ok')"]) == b"ok\n"
+
+
+def test_run_limited_reports_other_failures_as_runtime_errors():
+    with pytest.raises(RuntimeError, match="boom"):
+        run_limited([sys.executable, "-c", "import sys; sys.exit('boom')"])
+
+
+@pytest.mark.skipif(not hasattr(bot_pdf.resource, "prlimit"), reason="needs resource.prlimit")
+def test_run_limited_stops_a_process_over_its_cpu_time(monkeypatch):
+    monkeypatch.setattr(bot_pdf, "WORKER_CPU_SECONDS", 1)
+    with pytest.raises(JobLimitError, match="CPU time"):
+        run_limited([sys.executable, "-c", "while True: pass"])
+
+
+@pytest.mark.skipif(not hasattr(bot_pdf.resource, "prlimit"), reason="needs resource.prlimit")
+def test_run_limited_stops_a_process_over_its_memory(monkeypatch):
+    monkeypatch.setattr(bot_pdf, "WORKER_MEMORY_MB", 64)
+    with pytest.raises(JobLimitError, match="memory"):
+        run_limited([sys.executable, "-c", "b = bytearray(256 * 1024 * 1024)"])
+
+
+def test_run_limited_stops_a_process_over_its_wall_clock_time(monkeypatch):
+    monkeypatch.setattr(bot_pdf, "WORKER_TIMEOUT_SECONDS", 0.5)
+    with pytest.raises(JobLimitError, match="longer than"):
+        run_limited([sys.executable, "-c", "import time; time.sleep(10)"])
+
+
+def test_a_job_holds_at_most_max_in_flight_ocr_threads(monkeypatch):
+    monkeypatch.setattr(bot_pdf, "ocr_executor", ThreadPoolExecutor(max_workers=8))
+    lock = threading.Lock()
+    running = [0, 0]  # Now, peak
+
+    def page(number):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return number
+
+    tasks = [(page, number) for number in range(10)]
+    assert asyncio.run(run_on_ocr_threads(tasks, 2)) == list(range(10))
+    assert running[1] == 2
+
+
+def test_a_failed_job_waits_for_its_running_pages_and_drops_the_rest(monkeypatch):
+    monkeypatch.setattr(bot_pdf, "ocr_executor", ThreadPoolExecutor(max_workers=8))
+    finished = []
+    started = threading.Event()
+
+    def page(number):
+        if number == 0:
+            started.wait(1)
+            raise JobLimitError("a page exceeded the limit")
+        started.set()
+        time.sleep(0.1)
+        finished.append(number)
+
+    tasks = [(page, number) for number in range(10)]
+    with pytest.raises(JobLimitError):
+        asyncio.run(run_on_ocr_threads(tasks, 2))
+    # Page 1 was already running when page 0 failed; the others never started
+    assert finished == [1]
+
+
+def text_pdf(path, pages, font_size=12):
+    can = canvas.Canvas(str(path), pagesize=letter)
+    for _ in range(pages):
+        can.setFont("Helvetica", font_size)
+        can.drawString(72, 720, "Invoice 2024-001: 1 x Widget @ 19.99 EUR")
+        can.showPage()
+    can.save()
+    return {"path": str(path), "name": path.name, "type": "pdf"}
+
+
+@pytest.fixture
+def idle_server(monkeypatch):
+    monkeypatch.setattr(bot_pdf, "active_job_megapixels", 0.0)
+
+
+def test_jobs_over_the_file_size_limit_are_rejected_without_opening_them(tmp_path, monkeypatch, idle_server):
+    monkeypatch.setattr(bot_pdf, "JOB_MAX_FILE_MB", 0.001)
+    cost = estimate_job_cost([text_pdf(tmp_path / "big.pdf", 3)])
+    assert cost["pages"] == 0
+    ticket = admit_job(cost)
+    assert not ticket["admitted"]
+    assert "too large" in ticket["reason"]
+    assert bot_pdf.active_job_megapixels == 0
+
+
+def test_jobs_over_the_page_limit_are_rejected(tmp_path, monkeypatch, idle_server):
+    monkeypatch.setattr(bot_pdf, "JOB_MAX_PAGES", 2)
+    ticket = admit_job(estimate_job_cost([text_pdf(tmp_path / "long.pdf", 3)]))
+    assert not ticket["admitted"]
+    assert "too many pages" in ticket["reason"]
+
+
+def test_jobs_over_the_pixel_limit_are_downgraded_and_streamed(tmp_path, monkeypatch, idle_server):
+    # 6pt text is planned at 360 DPI: about 12 MP per letter page, 2 MP at 150 DPI
+    monkeypatch.setattr(bot_pdf, "JOB_MAX_MEGAPIXELS", 10)
+    file_info = text_pdf(tmp_path / "small_print.pdf", 2, font_size=6)
+    cost = estimate_job_cost([file_info])
+    assert cost["dpis"][file_info["path"]] == [360, 360]
+
+    ticket = admit_job(cost)
+    assert ticket["admitted"] and ticket["downgraded"] and ticket["streaming"]
+    assert ticket["dpis"][file_info["path"]] == [bot_pdf.JOB_DOWNGRADE_DPI] * 2
+    assert ticket["megapixels"] < 10
+    release_job(ticket)
+
+
+def test_jobs_are_rejected_while_the_global_budget_is_taken(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot_pdf, "active_job_megapixels", bot_pdf.GLOBAL_MAX_MEGAPIXELS)
+    ticket = admit_job(estimate_job_cost([text_pdf(tmp_path / "invoice.pdf", 1)]))
+    assert not ticket["admitted"]
+    assert "busy" in ticket["reason"]
+    assert bot_pdf.active_job_megapixels == bot_pdf.GLOBAL_MAX_MEGAPIXELS
+
+
+def test_release_job_returns_the_budget_exactly_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot_pdf, "active_job_megapixels", 5.0)  # Another job in flight
+    ticket = admit_job(estimate_job_cost([text_pdf(tmp_path / "invoice.pdf", 1)]))
+    assert ticket["admitted"]
+    assert bot_pdf.active_job_megapixels == pytest.approx(5.0 + ticket["megapixels"])
+
+    release_job(ticket)
+    release_job(ticket)
+    assert bot_pdf.active_job_megapixels == pytest.approx(5.0)
@@ -0,0 +1,53 @@
+import pikepdf
+import pytest
+from PIL import Image
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from bot_pdf import choose_ocr_dpis
+
+
+def text_pdf(path, font_size):
+    can = canvas.Canvas(str(path), pagesize=letter)
+    can.setFont("Helvetica", font_size)
+    can.drawString(72, 720, "Invoice 2024-001: 1 x Widget @ 19.99 EUR")
+    can.save()
+
+
+def scan_pdf(path, dpi, inches=2):
+    """A page of `inches` square entirely covered by a scan at `dpi`."""
+    size = inches * 72
+    can = canvas.Canvas(str(path), pagesize=(size, size))
+    scan = Image.new("L", (inches * dpi, inches * dpi), 255)
+    can.drawImage(ImageReader(scan), 0, 0, width=size, height=size)
+    can.save()
+
+
+@pytest.mark.parametrize("font_size, dpi", [(12, 180), (6, 360)])
+def test_text_pages_are_rendered_so_the_smallest_font_reaches_the_target_height(tmp_path, font_size, dpi):
+    text_pdf(tmp_path / "text.pdf", font_size)
+    assert choose_ocr_dpis(tmp_path / "text.pdf") == [dpi]
+
+
+@pytest.mark.parametrize("scan_dpi, dpi", [(150, 150), (600, 400)])
+def test_scanned_pages_are_rendered_at_the_scan_resolution_within_limits(tmp_path, scan_dpi, dpi):
+    scan_pdf(tmp_path / "scan.pdf", scan_dpi)
+    assert choose_ocr_dpis(tmp_path / "scan.pdf") == [dpi]
+
+
+def test_blank_pages_use_the_default_dpi(tmp_path):
+    can = canvas.Canvas(str(tmp_path / "blank.pdf"), pagesize=letter)
+    can.showPage()
+    can.save()
+    assert choose_ocr_dpis(tmp_path / "blank.pdf") == [300]
+
+
+def test_font_size_set_inside_q_q_does_not_leak_out(tmp_path):
+    pdf = pikepdf.new()
+    pdf.add_blank_page()
+    pdf.pages[0].Contents = pdf.make_stream(
+        b"BT /F1 12 Tf ET q BT /F1 3 Tf ET Q BT 1 0 0 1 72 72 Tm (x) Tj ET"
+    )
+    pdf.save(tmp_path / "nested.pdf")
+    assert choose_ocr_dpis(tmp_path / "nested.pdf") == [180]
@@ -0,0 +1,158 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from telegram.error import RetryAfter
+
+from bot_pdf import OutboundScheduler, PRIORITY_PROGRESS, PRIORITY_RESULT, edit_progress
+
+CHAT_INTERVAL = 0.05
+
+
+class FakeBotAPI:
+    """Stands in for the HTTP call PTB hands to the rate limiter."""
+
+    def __init__(self, fail_first=0):
+        self.sent = []
+        self.fail_first = fail_first
+
+    def request(self, text):
+        async def callback():
+            if self.fail_first:
+                self.fail_first -= 1
+                raise RetryAfter(1)
+            self.sent.append((text, time.monotonic()))
+            return {"text": text}
+        return callback
+
+
+def submit(scheduler, api, text, chat_id=1, endpoint="sendMessage", message_id=None, priority=None):
+    data = {"chat_id": chat_id}
+    if message_id:
+        data["message_id"] = message_id
+    rate_limit_args = {"priority": priority} if priority is not None else None
+    return asyncio.ensure_future(
+        scheduler.process_request(api.request(text), (), {}, endpoint, data, rate_limit_args)
+    )
+
+
+async def run_with_scheduler(scenario):
+    scheduler = OutboundScheduler(global_rate=1000, chat_interval=CHAT_INTERVAL)
+    await scheduler.initialize()
+    try:
+        return await scenario(scheduler)
+    finally:
+        await scheduler.shutdown()
+
+
+def test_pending_edits_of_a_message_are_coalesced():
+    api = FakeBotAPI()
+
+    async def scenario(scheduler):
+        # The first message makes the chat wait, so the edits queue up behind it
+        first = submit(scheduler, api, "menu")
+        edits = [
+            submit(scheduler, api, text, endpoint="editMessageText", message_id=10)
+            for text in ("25%", "50%", "100%")
+        ]
+        return await first, await asyncio.gather(*edits)
+
+    first, edits = asyncio.run(run_with_scheduler(scenario))
+    assert first == {"text": "menu"}
+    assert [text for text, _ in api.sent] == ["menu", "100%"]
+    assert edits == [{"text": "100%"}] * 3
+
+
+def test_results_are_sent_before_progress_updates():
+    api = FakeBotAPI()
+
+    async def scenario(scheduler):
+        busy = submit(scheduler, api, "menu")
+        progress = submit(scheduler, api, "working...", priority=PRIORITY_PROGRESS)
+        result = submit(scheduler, api, "done", priority=PRIORITY_RESULT)
+        await asyncio.gather(busy, progress, result)
+
+    asyncio.run(run_with_scheduler(scenario))
+    assert [text for text, _ in api.sent] == ["menu", "done", "working..."]
+
+
+def test_requests_to_one_chat_are_spaced_but_other_chats_are_not_held_up():
+    api = FakeBotAPI()
+
+    async def scenario(scheduler):
+        await asyncio.gather(
+            submit(scheduler, api, "a1", chat_id=1),
+            submit(scheduler, api, "a2", chat_id=1),
+            submit(scheduler, api, "b1", chat_id=2),
+        )
+
+    asyncio.run(run_with_scheduler(scenario))
+    times = dict(api.sent)
+    assert times["a2"] - times["a1"] >= CHAT_INTERVAL * 0.9
+    assert times["b1"] < times["a2"]
+
+
+def test_flood_limit_pauses_sending_and_retries():
+    api = FakeBotAPI(fail_first=1)
+
+    async def scenario(scheduler):
+        started = time.monotonic()
+        retried = submit(scheduler, api, "retried", chat_id=1)
+        await asyncio.sleep(CHAT_INTERVAL)  # Let the first attempt hit the flood limit
+        other = submit(scheduler, api, "other chat", chat_id=2)
+        return started, await asyncio.gather(retried, other)
+
+    started, results = asyncio.run(run_with_scheduler(scenario))
+    assert results == [{"text": "retried"}, {"text": "other chat"}]
+    times = dict(api.sent)
+    # RetryAfter(1) pauses every chat, not just the one that was limited
+    assert times["retried"] - started >= 0.9
+    assert times["other chat"] - started >= 0.9
+
+
+def test_initializing_twice_keeps_one_worker():
+    async def scenario():
+        scheduler = OutboundScheduler(global_rate=1000, chat_interval=CHAT_INTERVAL)
+        await scheduler.initialize()
+        worker = scheduler._worker
+        await scheduler.initialize()
+        try:
+            return worker is scheduler._worker
+        finally:
+            await scheduler.shutdown()
+
+    assert asyncio.run(scenario())
+
+
+class FakeBot:
+    """Routes context.bot.edit_message_text through the scheduler like ExtBot does."""
+
+    def __init__(self, scheduler, api):
+        self.scheduler = scheduler
+        self.api = api
+
+    async def edit_message_text(self, text, chat_id, message_id, rate_limit_args=None):
+        data = {"chat_id": chat_id, "message_id": message_id}
+        return await self.scheduler.process_request(
+            self.api.request(text), (), {}, "editMessageText", data, rate_limit_args
+        )
+
+
+def test_progress_updates_do_not_block_the_handler_and_are_superseded_by_its_result():
+    api = FakeBotAPI()
+    query = SimpleNamespace(message=SimpleNamespace(chat_id=1, message_id=10))
+
+    async def scenario(scheduler):
+        context = SimpleNamespace(bot=FakeBot(scheduler, api))
+        busy = submit(scheduler, api, "menu")
+        started = time.monotonic()
+        progress = await edit_progress(query, context, "Performing OCR...")
+        queued_in = time.monotonic() - started
+        result = await context.bot.edit_message_text("✅ OCR completed!", chat_id=1, message_id=10)
+        await asyncio.gather(busy, progress)
+        return queued_in, result, progress.result()
+
+    queued_in, result, progress = asyncio.run(run_with_scheduler(scenario))
+    assert queued_in < CHAT_INTERVAL / 2
+    assert [text for text, _ in api.sent] == ["menu", "✅ OCR completed!"]
+    assert result == progress == {"text": "✅ OCR completed!"}
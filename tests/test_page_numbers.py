@@ -0,0 +1,53 @@
+import pytest
+
+from bot_pdf import parse_insert_position, parse_page_numbers, parse_page_order, parse_pages_to_delete
+
+
+@pytest.mark.parametrize("text, pages", [
+    ("1", [1]),
+    ("1,3-5", [1, 3, 4, 5]),
+    (" 2 , 4-4 ", [2, 4]),
+    ("3 1 2", [3, 1, 2]),
+])
+def test_page_numbers_and_ranges_are_parsed_in_order(text, pages):
+    assert parse_page_numbers(text, 5) == pages
+
+
+@pytest.mark.parametrize("text, message", [
+    ("0", "between 1 and 5"),
+    ("6", "between 1 and 5"),
+    ("4-6", "between 1 and 5"),
+    ("5-3", "between 1 and 5"),
+    ("1,a", "Invalid page number"),
+    ("1--2", "Invalid page number"),
+    (" , ", "No page numbers"),
+])
+def test_invalid_or_out_of_range_page_numbers_are_rejected(text, message):
+    with pytest.raises(ValueError, match=message):
+        parse_page_numbers(text, 5)
+
+
+def test_pages_to_delete_may_not_be_every_page():
+    assert parse_pages_to_delete("1,3", 3) == {1, 3}
+    with pytest.raises(ValueError, match="every page"):
+        parse_pages_to_delete("1-3", 3)
+    with pytest.raises(ValueError, match="every page"):
+        parse_pages_to_delete("1,2,3,2", 3)
+
+
+def test_new_page_order_must_list_every_page_exactly_once():
+    assert parse_page_order("3,1,2", 3) == [3, 1, 2]
+    assert parse_page_order("2-3,1", 3) == [2, 3, 1]
+    for text in ("3,1", "3,1,2,2", "1,1,2"):
+        with pytest.raises(ValueError, match="exactly once"):
+            parse_page_order(text, 3)
+
+
+def test_insert_position_defaults_to_the_end():
+    assert parse_insert_position(None, 4) == 4
+    assert parse_insert_position(" ", 4) == 4
+    assert parse_insert_position("0", 4) == 0
+    assert parse_insert_position("2", 4) == 2
+    for caption in ("5", "-1", "two"):
+        with pytest.raises(ValueError, match="from 0 to 4"):
+            parse_insert_position(caption, 4)
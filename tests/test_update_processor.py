@@ -0,0 +1,31 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot_pdf import PerUserUpdateProcessor
+
+
+def update_from(user_id):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+
+
+def test_updates_from_one_user_run_in_order_and_other_users_are_not_held_up():
+    events = []
+
+    async def handle(name, delay):
+        events.append(f"{name} start")
+        await asyncio.sleep(delay)
+        events.append(f"{name} end")
+
+    async def scenario():
+        processor = PerUserUpdateProcessor()
+        await asyncio.gather(
+            processor.process_update(update_from(1), handle("ocr", 0.05)),
+            processor.process_update(update_from(1), handle("done", 0)),
+            processor.process_update(update_from(2), handle("other user", 0)),
+        )
+        return processor
+
+    processor = asyncio.run(scenario())
+    assert events.index("done start") > events.index("ocr end")
+    assert events.index("other user end") < events.index("ocr end")
+    assert not processor._users